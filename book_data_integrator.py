@@ -4,9 +4,11 @@
 '''
 import argparse
 import logging
+import numpy as np
 import pandas as pd
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz, process
 from goodreads_md_processor import GoodreadsMdProcessor
+from json_lines import write_json_lines
 from story_graph_export_cleaner import StoryGraphExportCleaner
 
 
@@ -18,9 +20,6 @@ class BookDataIntegrator:
     def __init__(
             self, goodreads_directory, story_graph_file,
             output_file, log_level='INFO'):
-        logging.basicConfig(
-            format='%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s', datefmt='%Y-%m-%d:%H:%M:%S',
-        )
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
         self.logger.info(
@@ -84,9 +83,7 @@ class BookDataIntegrator:
         """
         # filter ISBN remove na and empty string
         goodreads_isbn = self.goodreads_df[
-            (self.goodreads_df['goodreads_isbn'].notna()) & \
-            (self.goodreads_df['goodreads_isbn'] != '') & \
-            (self.goodreads_df['goodreads_isbn'].notnull())
+            self.goodreads_df['goodreads_isbn'].fillna('').ne('')
         ]
         self.logger.info(
             "goodreads_isbn length: %s, iloc[0]:\n%s, ",
@@ -94,9 +91,7 @@ class BookDataIntegrator:
                 goodreads_isbn.iloc[0]
         )
         storygraph_isbn = self.story_graph_df[
-            (self.story_graph_df['story_graph_isbn'].notna()) & \
-            (self.story_graph_df['story_graph_isbn'] != '') & \
-            (self.story_graph_df['story_graph_isbn'].notnull())
+            self.story_graph_df['story_graph_isbn'].fillna('').ne('')
         ]
         self.logger.info(
             "storygraph_isbn length: %s, iloc[0]:\n%s, ",
@@ -104,13 +99,19 @@ class BookDataIntegrator:
                 storygraph_isbn.iloc[0]
         )
 
-        # Attempt to merge on ISBN first
+        # Attempt to merge on ISBN first, factorizing both columns together
+        # so the merge hashes int64 codes instead of ISBN strings
+        isbn_codes, _ = pd.factorize(pd.concat(
+            [goodreads_isbn['goodreads_isbn'], storygraph_isbn['story_graph_isbn']],
+            ignore_index=True
+        ))
         self.merged_df = pd.merge(
-            goodreads_isbn, storygraph_isbn,
-            left_on='goodreads_isbn', right_on='story_graph_isbn',
+            goodreads_isbn.assign(_isbn_key=isbn_codes[:len(goodreads_isbn)]),
+            storygraph_isbn.assign(_isbn_key=isbn_codes[len(goodreads_isbn):]),
+            on='_isbn_key',
             how='inner',
             indicator=True
-        )
+        ).drop(columns='_isbn_key')
         self.logger.info(
             "after ISBN merged_df length: %s, sg length: %s, iloc[0]:\n%s, ",
                 len(self.merged_df),
@@ -139,102 +140,167 @@ class BookDataIntegrator:
                 storygraph_no_isbn.iloc[0]
         )
 
-        fuzzy_matches = []
-
-        # Fuzzy matching for Title and Authors
-        for _, story_row in storygraph_no_isbn.iterrows():
-            self.logger.debug("tsg loop top: %s", story_row)
-            title = story_row['story_graph_Title']
-            authors = story_row['Authors'] if isinstance(
-                story_row['Authors'], list) else [story_row['Authors']]
-            review = story_row['story_graph_Review']
-
-            for _, goodreads_row in goodreads_no_isbn.iterrows():
-                self.logger.debug("gr loop top: %s", goodreads_row)
-                goodreads_title = goodreads_row['goodreads_title']
-                goodreads_authors = goodreads_row['author'] if isinstance(
-                    goodreads_row['author'], list
-                ) else [goodreads_row['author']]
-                goodreads_review = goodreads_row['goodreads_review']
-
-                self.logger.debug(
-                    'title type: %s, goodreads_title type: %s',
-                    type(title),
-                    type(goodreads_title)
-                )
-                self.logger.debug(
-                    'authors type: %s, goodreads_authors type: %s',
-                    type(authors),
-                    type(goodreads_authors)
-                )
-                self.logger.debug(
-                    'review type: %s, goodreads_review type: %s',
-                    type(review),
-                    type(goodreads_review)
-                )
-                title_match = False
-                review_match = False
-                author_match = False
-                if isinstance(title, str) and isinstance(goodreads_title, str):
-                    title_match = fuzz.partial_ratio(
-                        title.lower(), goodreads_title.lower()) >= 80
-                    self.logger.debug("title_match type: %s", type(title_match))
-                if isinstance(review, str) and isinstance(goodreads_review, str):
-                    review_match = fuzz.partial_ratio(
-                        review.lower(), goodreads_review.lower()) >= 80
-                    self.logger.debug("review_match type: %s", type(review_match))
-                if isinstance(authors, list) and len(authors) != 0 and \
-                    isinstance(goodreads_authors, list) and \
-                    len(goodreads_authors) != 0:
-
-                    author_match = any(
-                        fuzz.partial_ratio(
-                            author.lower(), ga.lower()
-                        ) >= 80 for ga in goodreads_authors for author in authors
-                    )
-                    self.logger.debug("author_match type: %s", type(author_match))
+        # Hash join on normalised title and first author, so only the
+        # leftovers go through fuzzy matching
+        goodreads_no_isbn = goodreads_no_isbn.assign(
+            _title_key=self.title_author_key(
+                goodreads_no_isbn['goodreads_title'],
+                goodreads_no_isbn['author']
+            )
+        )
+        storygraph_no_isbn = storygraph_no_isbn.assign(
+            _title_key=self.title_author_key(
+                storygraph_no_isbn['story_graph_Title'],
+                storygraph_no_isbn['Authors']
+            )
+        )
+        title_df = pd.merge(
+            goodreads_no_isbn[goodreads_no_isbn['_title_key'] != ''],
+            storygraph_no_isbn[storygraph_no_isbn['_title_key'] != ''],
+            on='_title_key',
+            how='inner'
+        )
+        # matched frames are concatenated once at the end
+        matched_frames = [self.merged_df, title_df.drop(columns='_title_key')]
+        goodreads_no_isbn = goodreads_no_isbn[
+            ~goodreads_no_isbn['_title_key'].isin(title_df['_title_key'])
+        ].drop(columns='_title_key')
+        storygraph_no_isbn = storygraph_no_isbn[
+            ~storygraph_no_isbn['_title_key'].isin(title_df['_title_key'])
+        ].drop(columns='_title_key')
+        self.logger.info(
+            "title matches: %s, goodreads left: %s, storygraph left: %s",
+                len(title_df),
+                len(goodreads_no_isbn),
+                len(storygraph_no_isbn)
+        )
 
-                if title_match and author_match:
-                    fuzzy_matches.append(
-                        pd.concat([goodreads_row, story_row]).to_frame().T
-                    )
-                elif review_match:
-                    fuzzy_matches.append(
-                        pd.concat([goodreads_row, story_row]).to_frame().T
-                    )
+        # Fuzzy matching for Title and Authors, scored for every
+        # storygraph x goodreads pair at once
+        title_match = self.fuzzy_match_matrix(
+            self.lower_strings(storygraph_no_isbn['story_graph_Title']),
+            self.lower_strings(goodreads_no_isbn['goodreads_title'])
+        )
+        review_match = self.fuzzy_match_matrix(
+            self.lower_strings(storygraph_no_isbn['story_graph_Review']),
+            self.lower_strings(goodreads_no_isbn['goodreads_review'])
+        )
+        # authors repeat across many books, so score each distinct pair
+        # once and expand back out to the rows
+        story_authors, story_owners, story_ids = self.flatten_authors(
+            storygraph_no_isbn['Authors']
+        )
+        goodreads_authors, goodreads_owners, goodreads_ids = \
+            self.flatten_authors(goodreads_no_isbn['author'])
+        author_hits = self.fuzzy_match_matrix(
+            story_authors, goodreads_authors
+        )[np.ix_(story_ids, goodreads_ids)]
+        author_match = np.zeros_like(title_match)
+        story_hits, goodreads_hits = np.nonzero(author_hits)
+        author_match[
+            story_owners[story_hits], goodreads_owners[goodreads_hits]
+        ] = True
+        self.logger.debug(
+            "title matches: %s, author matches: %s, review matches: %s",
+            title_match.sum(), author_match.sum(), review_match.sum()
+        )
 
-        if fuzzy_matches:
-            self.logger.debug(
-                "fuzzy_matches length: %s, iloc[0]:\n%s, ",
-                    len(fuzzy_matches),
-                    fuzzy_matches[0]
-            )
+        story_idx, goodreads_idx = np.nonzero(
+            (title_match & author_match) | review_match
+        )
 
-            fuzzy_df = pd.concat(fuzzy_matches, ignore_index=True)
+        if len(story_idx):
+            fuzzy_df = pd.concat([
+                goodreads_no_isbn.iloc[goodreads_idx].reset_index(drop=True),
+                storygraph_no_isbn.iloc[story_idx].reset_index(drop=True),
+            ], axis=1)
             self.logger.debug(
                 "fuzzy_df length: %s, iloc[0]:\n%s, ",
                     len(fuzzy_df),
                     fuzzy_df.iloc[0]
             )
-            self.logger.debug(
-                "end merged_df length: %s, iloc[0]:\n%s, ",
-                    len(self.merged_df),
-                    self.merged_df.iloc[0]
-            )
+            matched_frames.append(fuzzy_df)
 
-            self.merged_df = pd.concat(
-                [self.merged_df, fuzzy_df],
-                ignore_index=True
-            )
-            self.logger.debug(
-                "end merged_df length: %s, iloc[0]:\n%s, ",
-                    len(self.merged_df),
-                    self.merged_df.iloc[0]
-            )
+        self.merged_df = pd.concat(matched_frames, ignore_index=True)
+        self.logger.debug(
+            "end merged_df length: %s, iloc[0]:\n%s, ",
+                len(self.merged_df),
+                self.merged_df.iloc[0]
+        )
+
+    @staticmethod
+    def title_author_key(titles, authors):
+        '''
+        Join key of the lowercased letters and digits of the title and
+        first author, '' when either one is missing
+        '''
+        first_authors = authors.map(
+            lambda value: value[0] if isinstance(value, list) and value
+            else value
+        )
+        title_key = titles.astype('string').str.lower().str.replace(
+            r'[\W_]+', '', regex=True
+        ).fillna('')
+        author_key = first_authors.astype('string').str.lower().str.replace(
+            r'[\W_]+', '', regex=True
+        ).fillna('')
+        return (title_key + '|' + author_key).where(
+            (title_key != '') & (author_key != ''), ''
+        )
+
+    @staticmethod
+    def lower_strings(column):
+        ''' lowercase the strings in column, anything else becomes "" '''
+        return [
+            value.lower() if isinstance(value, str) else ''
+            for value in column
+        ]
+
+    @staticmethod
+    def flatten_authors(column):
+        '''
+        Flatten a column of author lists into the distinct lowercase
+        authors, plus for every (row, author) entry the row position and
+        the index of that author in the distinct list
+        '''
+        positions = {}
+        owners = []
+        author_ids = []
+        for owner, value in enumerate(column):
+            for author in value if isinstance(value, list) else [value]:
+                if isinstance(author, str):
+                    owners.append(owner)
+                    author_ids.append(
+                        positions.setdefault(author.lower(), len(positions))
+                    )
+        return (
+            list(positions),
+            np.array(owners, dtype=np.intp),
+            np.array(author_ids, dtype=np.intp)
+        )
+
+    @staticmethod
+    def fuzzy_match_matrix(left, right):
+        '''
+        Score every string in left against every string in right with
+        partial_ratio and return a boolean (len(left), len(right)) matrix
+        of the pairs scoring at least 80. Empty strings never match.
+        '''
+        scores = process.cdist(
+            left, right,
+            scorer=fuzz.partial_ratio,
+            score_cutoff=80,
+            workers=-1,
+            dtype=np.uint8
+        )
+        left_valid = np.array([bool(value) for value in left], dtype=bool)
+        right_valid = np.array([bool(value) for value in right], dtype=bool)
+        return (scores >= 80) & left_valid[:, None] & right_valid[None, :]
 
     def save_to_json(self):
         """Save merged DataFrame to JSON file."""
-        self.merged_df.to_json(self.output_file, orient='records', lines=True)
+        with open(self.output_file, 'wb') as file:
+            write_json_lines(self.merged_df, file)
         self.logger.info("DataFrame saved to JSON file: %s", self.output_file)
 
     def process(self):
@@ -276,6 +342,9 @@ if __name__ == '__main__':
         help='Set the logging level (default: INFO)'
     )
     args = parser.parse_args()
+    logging.basicConfig(
+        format='%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s', datefmt='%Y-%m-%d:%H:%M:%S',
+    )
     # process directory
     integrator = BookDataIntegrator(
         args.goodreads_directory,
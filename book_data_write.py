@@ -3,11 +3,18 @@
     combine data from Goodreads and The Story Graph
 '''
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
 import pathlib
+import re
 import string
+import pandas as pd
 import yaml
+try:
+    from yaml import CSafeDumper as YamlDumper
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeDumper as YamlDumper
 from book_data_integrator import BookDataIntegrator
 
 
@@ -81,6 +88,19 @@ SORT series ASC
 """)
 
 
+NON_PRINTABLE = re.compile(f'[^{re.escape(string.printable)}]+')
+TITLE_STRIP_CHARS = str.maketrans('', '', '[](){}_')
+
+
+class MarkdownDumper(YamlDumper):
+    ''' YAML dumper for front matter that writes pandas NA as null '''
+
+
+MarkdownDumper.add_representer(
+    type(pd.NA), lambda dumper, _: dumper.represent_none(None)
+)
+
+
 class BookDataWriter:
     ''''
     use BookDataIntegrator dataframes:
@@ -94,11 +114,6 @@ class BookDataWriter:
             story_graph_file,
             log_level='INFO'
     ):
-        logging.basicConfig(
-            format='%(asctime)s,%(msecs)03d %(levelname)-8s '
-            '[%(filename)s:%(lineno)d] %(message)s',
-            datefmt='%Y-%m-%d:%H:%M:%S',
-        )
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
         self.logger.info(
@@ -128,6 +143,11 @@ class BookDataWriter:
         """ delete old markdown files in the vault directory """
         pathlib.Path(filename).unlink(missing_ok=True)
 
+    def write_md(self, filename, text):
+        """ write a markdown file in the vault directory """
+        with open(filename, "w", encoding="utf-8") as file:
+            file.write(text)
+
     def remove_non_printable(self, text):
         """Removes non-printable characters from a string.
 
@@ -137,42 +157,27 @@ class BookDataWriter:
         Returns:
             The string with non-printable characters removed.
         """
-        return ''.join(char for char in text if char in string.printable)
-
-    def get_unique_values(self, *lists):
-        """ get unique values from a list of lists and strings """
-        combined_list = []
-        for lst in lists:
-            if isinstance(lst, list):
-                combined_list.extend(lst)
-            else:
-                combined_list.append(lst)
-        unique_values = list(set(combined_list))
-        return unique_values
+        return NON_PRINTABLE.sub('', text)
 
     def clean_title(self, title1, title2):
         """ remove characters from title that are not in both """
         title1 = self.remove_non_printable(title1)
         title2 = self.remove_non_printable(title2)
         if ':' in title1:
-            title1 = title1.split(':', maxsplit=1)
+            title1 = title1.split(':', maxsplit=1)[0]
         if ':' in title2:
-            title2 = title2.split(':', maxsplit=1)
-        for char in '[](){}_':
-            title1 = title1.replace(char, '')
-            title2 = title2.replace(char, '')
-        combined_string = title1 + title1
-        unique_chars = set(combined_string)
+            title2 = title2.split(':', maxsplit=1)[0]
+        title1 = title1.translate(TITLE_STRIP_CHARS)
+        title2 = title2.translate(TITLE_STRIP_CHARS)
+        unmatched_chars = set(title1) ^ set(title2)
         self.logger.info(
-            "unique_chars: %s unique_chars length: %s",
-            unique_chars, len(unique_chars),
+            "unmatched_chars: %s unmatched_chars length: %s",
+            unmatched_chars, len(unmatched_chars),
         )
 
-        for char in unique_chars:
-            if char in title1 and char in title2:
-                continue
-            title1 = title1.replace(char, '')
-            title2 = title2.replace(char, '')
+        unmatched_table = dict.fromkeys(map(ord, unmatched_chars))
+        title1 = title1.translate(unmatched_table)
+        title2 = title2.translate(unmatched_table)
         self.logger.info(
             "title1: %s title1 length: %s, title2: %s title2 length: %s",
             title1, len(title1),
@@ -220,7 +225,17 @@ class BookDataWriter:
         unique_authors = set()
         unique_series = set()
         unique_tags = set()
-        for _, row in self.merged_df.iterrows():
+        # each row's values in these columns are merged into the set
+        unique_columns = (
+            (unique_authors, ('Authors', 'author')),
+            (unique_series, ('seriesName', 'series')),
+            (unique_tags, ('readStatus', 'shelves', 'Tags')),
+        )
+        # file I/O is batched and run on a thread pool after the loop;
+        # keyed by path so a repeated title still ends up with the last row
+        to_write = {}
+        to_delete = []
+        for row in self.merged_df.to_dict('records'):
             if row['story_graph_Title'] == row['goodreads_title']:
                 title = row['story_graph_Title']
             else:
@@ -234,30 +249,29 @@ class BookDataWriter:
             self.logger.info(
                 "outfile: %s", outfile
             )
-            with open(outfile, "w", encoding="utf-8") as file:
-                file.write(yaml.dump(row.to_dict(), sort_keys=False))
-            old_gr_file = os.path.join(
+            to_write[outfile] = yaml.dump(
+                row, Dumper=MarkdownDumper, sort_keys=False
+            )
+            to_delete.append(os.path.join(
                 self.vault_directory,
                 '/Goodreads/',
-                f'{row['goodreads_title']} - {row['id']}.md')
-            self.delete_old_md(old_gr_file)
-            old_gr_file = os.path.join(
+                f"{row['goodreads_title']} - {row['id']}.md"))
+            to_delete.append(os.path.join(
                 self.vault_directory,
                 '/StoryGraph/',
-                f'{row['story_graph_Title']}.md')
-            self.delete_old_md(old_gr_file)
-            for item in self.get_unique_values(
-                row['Authors'], row['author']
-            ):
-                unique_authors.add(item)
-            for item in self.get_unique_values(
-                row['seriesName'], row['series']
-            ):
-                unique_series.add(item)
-            for item in self.get_unique_values(
-                row['readStatus'], row['shelves'], row['Tags']
-            ):
-                unique_tags.add(item)
+                f"{row['story_graph_Title']}.md"))
+            for unique_values, columns in unique_columns:
+                for column in columns:
+                    if isinstance(row[column], list):
+                        unique_values.update(row[column])
+                    else:
+                        unique_values.add(row[column])
+
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(
+                self.write_md, to_write.keys(), to_write.values()
+            ))
+            list(executor.map(self.delete_old_md, to_delete))
 
         self.write_author_files(unique_authors)
         self.write_series_files(unique_series)
@@ -293,6 +307,11 @@ if __name__ == '__main__':
         help='Set the logging level (default: INFO)'
     )
     args = parser.parse_args()
+    logging.basicConfig(
+        format='%(asctime)s,%(msecs)03d %(levelname)-8s '
+        '[%(filename)s:%(lineno)d] %(message)s',
+        datefmt='%Y-%m-%d:%H:%M:%S',
+    )
     # process directory
     BookWriter = BookDataWriter(
         args.vault_directory,
@@ -6,13 +6,56 @@
 '''
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
-import glob
 import logging
 import os
+import re
 
 import pandas as pd
 import yaml
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
+from json_lines import write_json_lines
+
+# YAML between the opening '---' line and the next '---' line (or EOF)
+FRONT_MATTER = re.compile(
+    rb'---\r?\n(.*?)(?:^---\r?$|\Z)', re.DOTALL | re.MULTILINE
+)
+# an id key, plain or quoted, in block or flow style, checked before
+# parsing; a false match only costs a parse, a miss would drop the file
+ID_KEY = re.compile(rb'(?:^|[{,])[ \t]*["\']?id["\']?[ \t]*:', re.MULTILINE)
+# strips the [[ ]] around Obsidian links in one pass
+LINK_BRACKETS = str.maketrans('', '', '[]')
+
+
+def load_front_matter(file):
+    '''
+    Load the YAML front matter of one (filepath, filename) markdown file.
+    This runs in a worker process, so instead of logging it returns
+    (filename, data, error) where error holds the logger.log arguments.
+    '''
+    filepath, filename = file
+    try:
+        with open(filepath, 'rb') as md_file:
+            front_matter = FRONT_MATTER.match(md_file.read())
+    except FileNotFoundError:
+        return filename, None, (logging.WARNING, "File not found: %s", filepath)
+    if front_matter is None or not ID_KEY.search(front_matter.group(1)):
+        # make_goodreads_df drops records without an id, skip the parse
+        return filename, None, (
+            logging.WARNING, "ID missing for filename: %s", filename
+        )
+    try:
+        # libyaml decodes the UTF-8 bytes itself
+        data = yaml.load(front_matter.group(1), Loader=YamlLoader)
+    except yaml.YAMLError as e:
+        return filename, None, (
+            logging.ERROR, "Error reading YAML file %s: %s", filename, str(e)
+        )
+    return filename, data, None
 
 
 class GoodreadsMdProcessor:
@@ -20,9 +63,6 @@ class GoodreadsMdProcessor:
     Get a dataframe from the Goodreads markdown files created with Booksidian
     '''
     def __init__(self, directory, output_file, log_level='INFO'):
-        logging.basicConfig(
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
         self.directory = directory
@@ -34,45 +74,39 @@ class GoodreadsMdProcessor:
         self.yaml_data = {}
         self.df = None
 
-    def get_yaml(self, f):
-        ''' Get the YAML data from the file '''
-        pointer = f.tell()
-        if f.readline() != '---\n':
-            f.seek(pointer)
-            self.logger.debug("YAML header not found; returning empty data.")
-            return ''
-        lines = []
-        for line in f:
-            if line == '---\n':
-                break
-            lines.append(line)
-        return ''.join(lines)
-
     def filter_data(self, data):
         ''' Remove markdown links from data '''
-        self.logger.debug(
-            'filter_data data:%s, data type: %s', data, type(data)
-        )
+        # runs once per file, so only pay for debug logging when enabled
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.logger.debug(
+                'filter_data data:%s, data type: %s', data, type(data)
+            )
         result_data = {}
         if isinstance(data, dict):
             for k, v in data.items():
-                self.logger.debug('filter_data k:%s, v type: %s', k, type(v))
+                if debug:
+                    self.logger.debug(
+                        'filter_data k:%s, v type: %s', k, type(v)
+                    )
                 if k is None:
                     continue
                 if k == 'author':
-                    self.logger.debug(
-                        "filter_data author v:%s, v type: %s", v, type(v)
-                    )
+                    if debug:
+                        self.logger.debug(
+                            "filter_data author v:%s, v type: %s", v, type(v)
+                        )
                     if isinstance(v, list):
-                        v = [author.replace('Authors/', '').replace(
-                            ']', '').replace('[', '') for author in v]
+                        v = [
+                            author.translate(LINK_BRACKETS)
+                            .removeprefix('Authors/') for author in v
+                        ]
                     else:
-                        v = v.replace('Authors/', '').replace(
-                            ']', '').replace('[', '')
+                        v = v.translate(LINK_BRACKETS).removeprefix('Authors/')
                 if k == 'shelves':
                     shelves = [
-                        shelf.replace('Shelves/', '').replace(']', '')
-                        .replace('[', '') for shelf in v
+                        shelf.translate(LINK_BRACKETS)
+                        .removeprefix('Shelves/') for shelf in v
                     ]
                     v = shelves
                 result_data[k] = v
@@ -82,30 +116,32 @@ class GoodreadsMdProcessor:
         """
         Reads all YAML files in a directory and returns a dictionary
         where keys are filenames and values are the loaded YAML data.
+        Files are parsed in parallel on a process pool.
         """
         all_data = {}
         self.logger.info("Reading files from directory: %s", self.directory)
-        # Use glob to find all files ending with .yaml or .yml
-        files = glob.glob(os.path.join(self.directory, "*.md"))
-        for filepath in files:
-            self.logger.debug('read_yaml_files filepath:%s', filepath)
-            filename = os.path.basename(filepath)
-            try:
-                with open(filepath, 'r', encoding="utf8") as file:
-                    data = yaml.load(self.get_yaml(file), Loader=yaml.Loader)
-                    all_data[filename] = self.filter_data(data)
+        # Find all markdown files, skipping hidden ones like glob did
+        with os.scandir(self.directory) as entries:
+            files = [
+                (entry.path, entry.name) for entry in entries
+                if entry.name.endswith('.md')
+                and not entry.name.startswith('.')
+                and entry.is_file()
+            ]
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        with ProcessPoolExecutor() as executor:
+            for filename, data, error in executor.map(
+                load_front_matter, files, chunksize=64
+            ):
+                if error is not None:
+                    self.logger.log(*error)
+                    continue  # Skip to the next file if one fails
+                all_data[filename] = self.filter_data(data)
+                if debug:
                     self.logger.debug(
                         "Successfully read and filtered data from: %s",
                         filename
                     )
-            except yaml.YAMLError as e:
-                self.logger.error(
-                    "Error reading YAML file %s: %s",
-                    filename, e
-                )
-            except FileNotFoundError:
-                self.logger.warning("File not found: %s", filepath)
-                continue  # Skip to the next file if one is not found
         self.yaml_data = all_data
         self.logger.info("Total files processed: %d", len(all_data))
 
@@ -114,30 +150,33 @@ class GoodreadsMdProcessor:
         self.read_yaml_files()
         self.logger.debug('make_goodreads_df yaml_data:%s', self.yaml_data)
         final_dict = {}
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         for filename, data in self.yaml_data.items():
-            self.logger.debug(
-                'make_goodreads_df data:%s, data type:%s',
-                data, type(data)
-            )
+            if debug:
+                self.logger.debug(
+                    'make_goodreads_df data:%s, data type:%s',
+                    data, type(data)
+                )
             if data is None:
                 self.logger.warning('Filename: %s, data is None', filename)
             elif 'id' in data:
-                gid = data['id']
-                final_dict[gid] = {
-                    'filename': filename,
-                    **{k: v for k, v in data.items() if k != 'id'}
-                }
+                # data is the dict filter_data built, so tag it in place
+                data['filename'] = filename
+                final_dict[data['id']] = data
             else:
                 self.logger.warning(
                     'ID missing for filename: %s, data: %s',
                     filename, data
                 )
         self.logger.info("make_goodreads_df final_dict len:%s", len(final_dict))
-        self.df = pd.DataFrame.from_dict(final_dict, orient='index')
-        self.logger.info("make_goodreads_df df.iloc[0] 1:\n%s", self.df.iloc[0])
-        self.df.index.name = 'id'
-        self.df = self.df.reset_index()
-        self.logger.info("make_goodreads_df df.iloc[0] 2:\n%s", self.df.iloc[0])
+        records = list(final_dict.values())
+        # id and filename lead; the other keys follow in the order they
+        # first appear in the front matter
+        columns = list(dict.fromkeys(
+            ['id', 'filename', *(key for record in records for key in record)]
+        ))
+        self.df = pd.DataFrame.from_records(records, columns=columns)
+        self.logger.info("make_goodreads_df df.iloc[0]:\n%s", self.df.iloc[0])
 
     def get_goodreads_df(self):
         ''' return DataFrame '''
@@ -147,7 +186,8 @@ class GoodreadsMdProcessor:
 
     def save_to_json(self):
         ''' Save the DataFrame to a JSON file '''
-        self.df.to_json(self.output_file, orient='records', lines=True)
+        with open(self.output_file, 'wb') as file:
+            write_json_lines(self.df, file)
         self.logger.info("DataFrame saved to JSON file: %s", self.output_file)
 
 
@@ -171,6 +211,9 @@ if __name__ == '__main__':
         help='Set the logging level (default: INFO)'
     )
     args = parser.parse_args()
+    logging.basicConfig(
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     # process directory
     processor = GoodreadsMdProcessor(
         args.directory,
@@ -0,0 +1,44 @@
+''' Write DataFrames as JSON lines, with orjson when it is installed '''
+from datetime import date
+import json
+
+import pandas as pd
+try:
+    import orjson
+except ImportError:  # fall back to the json module
+    orjson = None
+
+
+def json_default(value):
+    '''
+    Serializer fallback: pandas missing values become null and dates
+    ISO strings, as orjson writes them natively
+    '''
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Type is not JSON serializable: {type(value).__name__}')
+
+
+def write_json_lines(df, file):
+    '''
+    Write df to the open binary file as JSON lines, with orjson when it
+    is installed and the json module otherwise; both give the same bytes,
+    including for the non-string keys of nested front matter mappings
+    '''
+    if orjson is not None:
+        for record in df.to_dict(orient='records'):
+            file.write(orjson.dumps(
+                record, default=json_default, option=(
+                    orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+                )
+            ))
+        return
+    # json writes NaN where orjson writes null
+    df = df.astype(object).where(df.notna(), None)
+    for record in df.to_dict(orient='records'):
+        file.write(json.dumps(
+            record, default=json_default, ensure_ascii=False,
+            separators=(',', ':')
+        ).encode('utf-8') + b'\n')
@@ -3,141 +3,164 @@
 import argparse
 import logging
 import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # fall back to pandas' C engine and str methods
+    pa = pc = None
+from json_lines import write_json_lines
+
+CONTENT_WARNING_LEVELS = ('Graphic', 'Moderate', 'Minor')
+CONTENT_WARNING_COLUMNS = [
+    f'contentWarnings{level}' for level in CONTENT_WARNING_LEVELS
+]
+
+
+def parse_content_warnings(test_note):
+    '''
+    Split a Content Warnings cell into (Graphic, Moderate, Minor) lists
+    '''
+    warnings = {level: [] for level in CONTENT_WARNING_LEVELS}
+    if isinstance(test_note, str):
+        for line in test_note.replace('\n', '').replace('\r', '').split(';'):
+            if ':' in line:
+                stuff = line.split(':')
+                key = stuff[0].strip()
+                if key in warnings:
+                    warnings[key] = [x.strip() for x in stuff[1].split(',')]
+    return tuple(warnings.values())
+
+
+def split_list_column(column):
+    '''
+    Split a comma separated column into lists of stripped strings,
+    trimming around the commas in the same regex pass; missing is [].
+    Uses the Arrow string kernels when pyarrow is installed.
+    '''
+    if pa is not None:
+        parts = pc.split_pattern_regex(
+            pc.utf8_trim_whitespace(pa.array(column, type=pa.string())),
+            r'\s*,\s*'
+        )
+        return pd.Series(
+            [[] if items is None else items for items in parts.to_pylist()],
+            index=column.index,
+            dtype=object
+        )
+    return column.astype('string').str.strip().str.split(
+        r'\s*,\s*', regex=True
+    ).map(lambda items: items if isinstance(items, list) else [])
+
+
+# dtypes applied by read_csv, keyed by the export's headers; every text
+# column is listed so pyarrow does not infer dates or None for empty cells
+CSV_DTYPES = {
+    'Title': 'string',
+    'Authors': 'string',
+    'Contributors': 'string',
+    'ISBN/UID': 'string',
+    'Format': 'string',
+    'Read Status': 'string',
+    'Date Added': 'string',
+    'Last Date Read': 'string',
+    'Dates Read': 'string',
+    'Read Count': 'Int64',
+    'Moods': 'string',
+    'Pace': 'string',
+    'Character- or Plot-Driven?': 'string',
+    'Strong Character Development?': 'string',
+    'Loveable Characters?': 'string',
+    'Diverse Characters?': 'string',
+    'Flawed Characters?': 'string',
+    'Review': 'string',
+    'Content Warnings': 'string',
+    'Content Warning Description': 'string',
+    'Tags': 'string',
+    'Owned?': 'string',
+}
+# rows per chunk when streaming an export straight to JSON
+CHUNK_SIZE = 100_000
+# pyarrow's multithreaded CSV reader when it is installed
+CSV_ENGINE = 'c' if pa is None else 'pyarrow'
 
 
 class StoryGraphExportCleaner:
     ''' Convert a "The Story Graph" export CSV to DataFrame '''
+    # export headers renamed to the names used downstream
+    COLUMN_NAMES = {
+        'Character- or Plot-Driven?': 'driver',
+        'Strong Character Development?': 'charactersDevelopment',
+        'Loveable Characters?': 'charactersLoveable',
+        'Diverse Characters?': 'charactersDiverse',
+        'Flawed Characters?': 'charactersFlawed',
+        'Star Rating': 'rating',
+        'Date Added': 'dateAdded',
+        'Dates Read': 'dateRead',
+        'Read Status': 'readStatus',
+        'Read Count': 'readCount',
+        'Last Date Read': 'lastDateRead',
+        'Content Warnings': 'contentWarnings',
+        'Content Warning Description': 'contentWarningsDescription',
+        'ISBN/UID': 'ISBN',
+    }
+
     def __init__(self, input_file, output_file, log_level='INFO'):
-        logging.basicConfig(
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
         self.input_file = input_file
         self.output_file = output_file or input_file.replace("csv", "json")
         self.df = None
 
-    def split_content_warnings(self, row):
-        ''' Convert contentWarnings dict into 3 separate columns '''
-        cw_graphic = []
-        cw_moderate = []
-        cw_minor = []
-        self.logger.debug(
-            "Processing row for content warnings: %s",
-            row['contentWarnings']
-        )
+    def clean_df(self, df):
+        ''' Rename and split the columns of a raw export DataFrame '''
+        df = df.rename(columns=self.COLUMN_NAMES)
 
-        if row['contentWarnings'].get("Graphic"):
-            cw_graphic = row['contentWarnings']["Graphic"]
-        if row['contentWarnings'].get("Moderate"):
-            cw_moderate = row['contentWarnings']["Moderate"]
-        if row['contentWarnings'].get("Minor"):
-            cw_minor = row['contentWarnings']["Minor"]
-
-        return pd.Series([
-            cw_graphic,
-            cw_moderate,
-            cw_minor],
-            index=[
-                'contentWarningsGraphic',
-                'contentWarningsModerate',
-                'contentWarningsMinor'
-            ]
+        # read_csv already set dtypes, so only the list columns and
+        # contentWarnings are left to split
+        df['Authors'] = split_list_column(df['Authors'])
+        df['Contributors'] = split_list_column(df['Contributors'])
+        df['Moods'] = split_list_column(df['Moods'])
+        df[CONTENT_WARNING_COLUMNS] = pd.DataFrame(
+            df.pop('contentWarnings').map(parse_content_warnings).tolist(),
+            index=df.index,
+            columns=CONTENT_WARNING_COLUMNS
         )
-
-    def content_warnings_to_dict(self, test_note):
-        '''
-        Split contentWarnings into dict with keys:
-            Graphic, Moderate, Minor
-        '''
-        my_dict = {}
-        if isinstance(test_note, str):
-            for line in test_note.split(";"):
-                self.logger.debug('line: %s', line)
-                if ':' in line:
-                    stuff = line.replace('\n', '').replace('\r', '').split(":")
-                    self.logger.debug('stuff: %s', stuff)
-                    my_dict[stuff[0].strip()] = [
-                        x.strip() for x in stuff[1].split(',')
-                    ]
-        return my_dict
+        df['Tags'] = split_list_column(df['Tags'])
+        return df
 
     def process_file(self):
         ''' Pre-process file for import '''
         self.logger.info("Processing file: %s", self.input_file)
-        self.df = pd.read_csv(self.input_file)
-        self.df.rename(columns={
-            'Character- or Plot-Driven?': 'driver',
-            'Strong Character Development?': 'charactersDevelopment',
-            'Loveable Characters?': 'charactersLoveable',
-            'Diverse Characters?': 'charactersDiverse',
-            'Flawed Characters?': 'charactersFlawed',
-            'Star Rating': 'rating',
-            'Date Added': 'dateAdded',
-            'Dates Read': 'dateRead',
-            'Read Status': 'readStatus',
-            'Read Count': 'readCount',
-            'Last Date Read': 'lastDateRead',
-            'Content Warnings': 'contentWarnings',
-            'Content Warning Description': 'contentWarningsDescription',
-            'ISBN/UID': 'ISBN',
-        }, inplace=True)
-
-        # Change dtypes and clean up contentWarnings
-        self.df['Title'] = self.df['Title'].astype('string')
-        self.df['Authors'] = self.df[
-            'Authors'].str.split(',').fillna('').apply(
-            lambda x: [item.strip() for item in x]
-        )
-        self.df['Contributors'] = self.df[
-            'Contributors'].str.split(',').fillna('').apply(
-            lambda x: [item.strip() for item in x]
-        )
-        self.df['ISBN'] = self.df['ISBN'].astype('string')
-        self.df['Format'] = self.df['Format'].astype('string')
-        self.df['readStatus'] = self.df['readStatus'].astype('string')
-        self.df['readCount'] = self.df['readCount'].astype('Int64')
-        self.df['Moods'] = self.df['Moods'].astype('string')
-        self.df['Moods'] = self.df['Moods'].str.split(',').fillna('').apply(
-            lambda x: [item.strip() for item in x]
-        )
-        self.df['Pace'] = self.df['Pace'].astype('string')
-        self.df['driver'] = self.df['driver'].astype('string')
-        self.df['charactersDevelopment'] = self.df[
-            'charactersDevelopment'].astype('string')
-        self.df['charactersLoveable'] = self.df[
-            'charactersLoveable'].astype('string')
-        self.df['charactersDiverse'] = self.df[
-            'charactersDiverse'].astype('string')
-        self.df['charactersFlawed'] = self.df[
-            'charactersFlawed'].astype('string')
-        self.df['Review'] = self.df['Review'].astype('string')
-        self.df['contentWarnings'] = self.df[
-            'contentWarnings'].astype('string')
-        self.df['contentWarnings'] = self.df['contentWarnings'].apply(
-            self.content_warnings_to_dict
-        )
-        new_columns = [
-            'contentWarningsGraphic',
-            'contentWarningsModerate',
-            'contentWarningsMinor'
-        ]
-        self.df[new_columns] = self.df.apply(
-            self.split_content_warnings, axis=1
-        )
-        self.df.drop('contentWarnings', axis=1, inplace=True)
-        self.df['contentWarningsDescription'] = self.df[
-            'contentWarningsDescription'].astype('string')
-        self.df['Tags'] = self.df['Tags'].str.split(',').fillna('').apply(
-            lambda x: [item.strip() for item in x]
-        )
-        self.df['Owned?'] = self.df['Owned?'].astype('string')
+        self.df = self.clean_df(pd.read_csv(
+            self.input_file, dtype=CSV_DTYPES, engine=CSV_ENGINE
+        ))
         self.logger.debug("Processed df.iloc[0]:\n%s", self.df.iloc[0])
         return self.df
 
+    def process_file_chunks(self, chunksize=CHUNK_SIZE):
+        '''
+        Pre-process file for import in chunks of chunksize rows, yielding
+        each cleaned DataFrame so the whole export is never in memory
+        '''
+        self.logger.info("Processing file in chunks: %s", self.input_file)
+        # the pyarrow engine can not read in chunks
+        with pd.read_csv(
+            self.input_file, dtype=CSV_DTYPES, chunksize=chunksize
+        ) as reader:
+            for chunk in reader:
+                yield self.clean_df(chunk)
+
     def save_to_json(self):
-        ''' Save the DataFrame to a JSON file '''
-        self.df.to_json(self.output_file, orient='records', lines=True)
+        '''
+        Save the DataFrame to a JSON file, streaming the export chunk by
+        chunk when process_file has not been run
+        '''
+        with open(self.output_file, 'wb') as file:
+            if self.df is not None:
+                write_json_lines(self.df, file)
+            else:
+                for chunk in self.process_file_chunks():
+                    write_json_lines(chunk, file)
         self.logger.info("DataFrame saved to JSON file: %s", self.output_file)
 
 
@@ -161,11 +184,13 @@ if __name__ == '__main__':
         help='Set the logging level (default: INFO)'
     )
     args = parser.parse_args()
+    logging.basicConfig(
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     # process directory
     cleaner = StoryGraphExportCleaner(
         args.filename,
         args.outfile,
         args.log.upper()
     )
-    cleaner.process_file()
     cleaner.save_to_json()